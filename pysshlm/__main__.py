@@ -26,7 +26,10 @@ def main(args=None):
     print (banner)
 
     # build the wrapper
-    w = ThinWrapper (['ssh', '-t', ssharg])
+    w = ThinWrapper (['ssh', '-t', ssharg],
+                     reconnect=args.reconnect,
+                     reattach=args.reattach,
+                     split_process=args.split_process)
     # enter the wrapper (spawns 2 threads to flow input and
     # output, so is non-blocking)
     w.enter()
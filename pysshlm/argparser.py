@@ -3,3 +3,12 @@ import argparse
 argparser = argparse.ArgumentParser()
 argparser.add_argument ('ssharg',
                         help='single argument to ssh (eg. host or user@host)')
+argparser.add_argument ('--reconnect', action='store_true',
+                        help='reconnect when the connection drops, ' +
+                        'queueing line-mode input while offline')
+argparser.add_argument ('--reattach', choices=['tmux', 'screen'],
+                        help='re-attach to a remote tmux / screen session ' +
+                        'on each connection')
+argparser.add_argument ('--split-process', action='store_true',
+                        help='render output in a separate process, so ' +
+                        'heavy output never delays keypresses')
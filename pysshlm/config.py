@@ -1,9 +1,9 @@
 from os import path
 
-from ConfigParser import SafeConfigParser
+from six.moves.configparser import RawConfigParser
 
 here = path.abspath (path.dirname (__file__))
 
-configparser = SafeConfigParser()
+configparser = RawConfigParser()
 configparser.read (path.join (here, "pysshlm.cfg"))
 pysshlm_config = configparser._sections['pysshlm']
@@ -0,0 +1,244 @@
+import select
+import threading
+import uuid
+
+from six.moves.queue import Queue, Empty, Full
+
+from ptyprocess import PtyProcessUnicode
+
+from pysshlm.config import pysshlm_config
+from pysshlm.utils import strip_escape_sequences
+
+
+# raised when a host sends no output for longer than the timeout
+class HostTimeout (Exception):
+    pass
+
+
+# drives a single non-interactive ssh session through a PTY, without
+# needing a real tty attached (unlike ThinWrapper, which puts stdin
+# into raw mode and writes to stdout)
+class HostSession():
+
+    # dimensions given to the PTY, since there is no user terminal
+    # to read them from
+    DIMENSIONS = (24, 200)
+
+    # how much of the trailing output is kept to match the prompt against
+    PROMPT_WINDOW = 256
+
+    def __init__ (self, host):
+        self.host = host
+        # scripts set the remote shell's prompt to this, so that it can't
+        # be confused with output which happens to end in "$" or ">"
+        self._prompt = "__pysshlm_%s__" % (uuid.uuid4().hex,)
+        self._pty = None
+
+    # run a single command and yield its output as it arrives, until the
+    # remote end closes the session. timeout is how many seconds the
+    # command may go without output, by default forever
+    def run_command (self, command, timeout=None):
+        self._spawn (self._command_cmd (command))
+        try:
+            while True:
+                s = self._read (timeout)
+                if s is None:
+                    return
+                yield s
+        finally:
+            self.close()
+
+    # run a script line by line in an interactive (sh-compatible) shell,
+    # yielding output as it arrives. Each line is submitted the same way
+    # line-mode submits its buffer, once the prompt shows the shell is
+    # ready for it
+    def run_script (self, lines, timeout=None):
+        if timeout is None:
+            timeout = float (pysshlm_config.get ("script_timeout"))
+        self._spawn (self._script_cmd())
+        try:
+            # the prompt is quoted in two halves, so that the shell's echo
+            # of this line can't match it
+            half = len (self._prompt) // 2
+            self._pty.write ("PS1='%s''%s'; PS2=''\r" %
+                            (self._prompt [:half], self._prompt [half:]))
+            for s in self._read_until_prompt (timeout):
+                yield s
+            for line in lines:
+                self._pty.write (line + '\r')
+                for s in self._read_until_prompt (timeout):
+                    yield s
+        finally:
+            self.close()
+
+    def close (self):
+        if self._pty is not None and self._pty.isalive():
+            self._pty.terminate (force=True)
+
+    def _command_cmd (self, command):
+        return ['ssh', self.host, command]
+
+    def _script_cmd (self):
+        return ['ssh', '-t', self.host]
+
+    def _spawn (self, cmd):
+        self._pty = PtyProcessUnicode.spawn (cmd, dimensions=self.DIMENSIONS)
+
+    # read a chunk of output, returning None on EOF
+    def _read (self, timeout):
+        ready, _, _ = select.select ([self._pty.fd], [], [], timeout)
+        if not ready:
+            raise HostTimeout ("%s: no output for %s seconds" %
+                            (self.host, timeout))
+        try:
+            return self._pty.read (size=1024)
+        except EOFError:
+            return None
+
+    # yield output until it ends with the prompt
+    def _read_until_prompt (self, timeout):
+        tail = ""
+        while True:
+            s = self._read (timeout)
+            if s is None:
+                raise EOFError ("%s: session closed before prompt" %
+                                (self.host,))
+            yield s
+            tail = (tail + s) [-self.PROMPT_WINDOW:]
+            if strip_escape_sequences (tail).endswith (self._prompt):
+                return
+
+
+# the output of HostSessions run on many hosts, at most concurrency at
+# a time, iterated as (host, chunk) pairs in the order the chunks arrive
+class MultiHostRun():
+
+    # how many chunks of output may wait for the consumer before the
+    # hosts producing them are held up
+    QUEUE_SIZE = 256
+
+    # how often a worker held up by a full queue checks for close()
+    PUT_INTERVAL = 0.1
+
+    # put on the output queue by a worker once it runs out of hosts
+    _WORKER_DONE = object()
+
+    def __init__ (self, hosts, run_session, concurrency=None):
+        if concurrency is None:
+            concurrency = int (pysshlm_config.get ("script_concurrency"))
+        # exceptions raised by each host's session, keyed by host
+        self.errors = {}
+        self._run_session = run_session
+        self._queue = Queue (maxsize=self.QUEUE_SIZE)
+        # hosts not yet picked up by a worker
+        self._hosts = Queue()
+        for host in hosts:
+            self._hosts.put (host)
+        # sessions currently running, so close() can terminate them
+        self._sessions = set()
+        self._sessions_lock = threading.Lock()
+        self._closed_flag = threading.Event()
+        self._workers_remaining = min (concurrency, len (hosts))
+        for i in range (self._workers_remaining):
+            worker = threading.Thread (target=self._work)
+            worker.daemon = True
+            worker.start()
+
+    # once closed, iteration stops, dropping any output not yet consumed
+    def __iter__ (self):
+        while (self._workers_remaining > 0 and
+                not self._closed_flag.is_set()):
+            try:
+                item = self._queue.get (timeout=self.PUT_INTERVAL)
+            except Empty:
+                continue
+            if item is self._WORKER_DONE:
+                self._workers_remaining -= 1
+            else:
+                yield item
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc_info):
+        self.close()
+
+    # consume all remaining output, returning it joined per host
+    def collect (self):
+        output = {}
+        for host, s in self:
+            output [host] = output.get (host, "") + s
+        return output
+
+    # stop starting hosts and terminate the sessions still running
+    def close (self):
+        with self._sessions_lock:
+            self._closed_flag.set()
+            for session in self._sessions:
+                session.close()
+
+    # run by each worker thread: take hosts until none are left
+    def _work (self):
+        try:
+            while True:
+                session = self._start_session()
+                if session is None:
+                    return
+                self._run_host (session)
+        finally:
+            self._put (self._WORKER_DONE)
+
+    # take the next host and register its session, or return None if
+    # there are none left or we're closed. Done under the lock so that
+    # close() can't miss a session which is just starting
+    def _start_session (self):
+        with self._sessions_lock:
+            if self._closed_flag.is_set():
+                return None
+            try:
+                host = self._hosts.get_nowait()
+            except Empty:
+                return None
+            session = HostSession (host)
+            self._sessions.add (session)
+            return session
+
+    def _run_host (self, session):
+        try:
+            for s in self._run_session (session):
+                if not self._put ((session.host, s)):
+                    return
+        except Exception as e:
+            if not self._closed_flag.is_set():
+                self.errors [session.host] = e
+        finally:
+            with self._sessions_lock:
+                self._sessions.discard (session)
+            session.close()
+
+    # put an item on the output queue, waiting while it's full,
+    # returning False if we're closed before it fits
+    def _put (self, item):
+        while not self._closed_flag.is_set():
+            try:
+                self._queue.put (item, timeout=self.PUT_INTERVAL)
+                return True
+            except Full:
+                pass
+        return False
+
+
+# run a command on many hosts at once. timeout is how many seconds a
+# command may go without output, by default forever
+def run_command (hosts, command, timeout=None, **kwargs):
+    return MultiHostRun (hosts,
+                    lambda session: session.run_command (command, timeout),
+                    **kwargs)
+
+
+# run a line-mode script on many hosts at once. timeout is how many
+# seconds to wait for output, by default script_timeout from pysshlm.cfg
+def run_script (hosts, lines, timeout=None, **kwargs):
+    return MultiHostRun (hosts,
+                    lambda session: session.run_script (lines, timeout),
+                    **kwargs)
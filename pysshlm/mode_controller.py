@@ -1,9 +1,15 @@
+import threading
+
+
 class ModeController():
 
     def __init__ (self, initial_mode=None):
         # basic state
         self.mode = initial_mode
         self._last_mode = self.mode
+        # held during transitions (including their react methods), and by
+        # anyone who needs the mode not to change under them
+        self.lock = threading.RLock()
         # _mode_transition_react_methods is a dictionary of methods
         # keyed by an old mode and then a new mode,
         # defining what code should run when transitioning from the
@@ -28,17 +34,24 @@ class ModeController():
 
     # transition to a given mode
     def transition_to (self, new_mode):
-        if (self.mode == new_mode):
-            return  # already in the mode
-        else:
-            # change the mode state
-            old_mode = self.mode
-            self._last_mode = old_mode
-            self.mode = new_mode
-            # run mode transition react methods
-            self._mode_left (old_mode)
-            self._mode_transitioned (old_mode, new_mode)
-            self._mode_entered (new_mode)
+        with self.lock:
+            if (self.mode == new_mode):
+                return  # already in the mode
+            else:
+                # change the mode state
+                old_mode = self.mode
+                self._last_mode = old_mode
+                self.mode = new_mode
+                # run mode transition react methods
+                self._mode_left (old_mode)
+                self._mode_transitioned (old_mode, new_mode)
+                self._mode_entered (new_mode)
+
+    # transition to a given mode only if currently in old_mode
+    def transition_from (self, old_mode, new_mode):
+        with self.lock:
+            if self.mode == old_mode:
+                self.transition_to (new_mode)
 
     # react to a mode transition
     def _mode_transitioned (self, old_mode, new_mode):
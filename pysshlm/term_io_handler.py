@@ -4,7 +4,7 @@ import threading
 
 class TermIOHandler():
 
-    def __init__ (self, pty):
+    def __init__ (self, pty, stdout_lock=None):
 
         # used to write to the pty
         self._pty = pty
@@ -12,8 +12,10 @@ class TermIOHandler():
         # used to prevent stdout writing contention / interleaving
         # thanks to Alex Martelli for suggesting this pattern
         # https://stackoverflow.com/a/3030755/4785602
-        self._stdout_lock = threading.RLock()
-        self._lock_nesting = 0
+        # (a lock shared with other processes may be given instead)
+        if stdout_lock is None:
+            stdout_lock = threading.RLock()
+        self._stdout_lock = stdout_lock
 
         # used to block processing keypresses while notifier active
         self.can_process_keypress_flag = threading.Event()
@@ -24,21 +26,29 @@ class TermIOHandler():
         # the currently-displayed notifier string
         self._current_notifier_str = ""
 
+    # swap in a new pty, eg. after reconnecting
+    def set_pty (self, pty):
+        self._pty = pty
+
     def pty_write (self, s):
         self._pty.write (s)
 
     def screen_write (self, s):
-        self._get_stdout_lock()
+        self.lock_screen()
         sys.stdout.write (s)
         sys.stdout.flush()
-        self._drop_stdout_lock()
+        self.unlock_screen()
 
     def screen_writeln (self, s):
-        s = "%s\r\n" % (s,)
-        self._get_stdout_lock()
-        sys.stdout.write (s)
-        sys.stdout.flush()
-        self._drop_stdout_lock()
+        self.screen_write ("%s\r\n" % (s,))
+
+    # hold the screen, keeping anyone else from writing to it until
+    # unlock_screen (calls may be nested)
+    def lock_screen (self):
+        self._stdout_lock.acquire()
+
+    def unlock_screen (self):
+        self._stdout_lock.release()
 
     # clear n characters backward (can't go past line-breaks)
     def backspace (self, n):
@@ -71,15 +81,3 @@ class TermIOHandler():
             self._notifier_write_lock.release()
             self.can_process_keypress_flag.set()
         threading.Timer (duration, remove_active_notifier).start()
-
-    # used to support screen_write
-    def _get_stdout_lock (self):
-        self._stdout_lock.acquire()
-        self._lock_nesting += 1
-
-    # used to support screen_write
-    def _drop_stdout_lock(self):
-        nesting = self._lock_nesting
-        self._lock_nesting = 0
-        for i in range (nesting):
-            self._stdout_lock.release()
@@ -6,6 +6,10 @@ import threading
 import signal
 import unicodedata
 import ast
+import multiprocessing
+import select
+
+import six
 
 from blessed import Terminal
 
@@ -18,21 +22,38 @@ from pysshlm.modes import (
         QUIT_PROMPT
 )
 from pysshlm.config import pysshlm_config
-from pysshlm.utils import get_term_dimensions
+from pysshlm.utils import get_term_dimensions, strip_escape_sequences
 from pysshlm.mode_controller import ModeController
+from pysshlm.triggers import TriggerEngine
 
 
 # wrapper class handling input buffering,
 # managing the opening and closing of the PTY
 class ThinWrapper():
 
-    def __init__ (self, cmd):
+    # ssh exits with this status when the connection fails or drops
+    SSH_CONNECTION_ERROR = 255
+    # seconds to wait for ssh to exit after its pty closes
+    SSH_EXIT_TIMEOUT = 5
+    # printed by the remote end when reconnecting, before it starts the
+    # shell (or re-attaches), to show that ssh connected and logged in
+    RECONNECTED_MARKER = '[pysshlm] reconnected'
+
+    # exit codes of the render process, telling us why it stopped
+    # (chosen not to collide with 1, the exit code of an uncaught exception)
+    RENDER_EOF = 100
+    RENDER_DECODE_ERROR = 101
+
+    def __init__ (self, cmd, reconnect=False, reattach=None,
+                  split_process=False):
         # blessings to the author of blessed for this
         self._t = Terminal()
         # used to transition between modes
         self._setup_mode_controller()
         # used to control the wrapper
         self._setup_hotkeys()
+        # used to highlight / alert on patterns in the output
+        self._setup_triggers()
         # used to hold the line buffer in line-editing mode
         self._line_buffer = ""
         # used to display a notifier when the line-mode is toggled
@@ -43,17 +64,46 @@ class ThinWrapper():
         self._quit_prompt_message = pysshlm_config.get ("quit_prompt_message")
         # save a reference to the cmd we will spawn
         self._cmd = cmd
+        # whether to reconnect when the connection drops, and if so, which
+        # remote multiplexer (tmux / screen) to re-attach to, if any
+        self._reconnect = reconnect
+        self._reattach_cmd = None
+        if reattach is not None:
+            self._reattach_cmd = pysshlm_config.get ("%s_attach_command" %
+                            (reattach,))
+            self._cmd = cmd + [self._reattach_cmd]
+        # the cmd spawned when reconnecting: prints the marker, then runs
+        # the reattach command, or a login shell
+        self._reconnect_cmd = cmd + ["echo '%s'; exec %s" %
+                        (self.RECONNECTED_MARKER,
+                         self._reattach_cmd or '"$SHELL" -l')]
+        # set while the connection is down and we're reconnecting
+        self._offline_flag = threading.Event()
+        # lines submitted in line-mode while offline, replayed on reconnect
+        self._offline_queue = []
+        # held while queueing or replaying, so no line is lost or reordered
+        self._offline_queue_lock = threading.Lock()
+        # set when the session ends
+        self._session_over_flag = threading.Event()
+        # whether to render output in a separate process, so that heavy
+        # output never competes for the GIL with keypress handling
+        self._split_process = split_process
+        self._render_process = None
         # spawn the PTY (get dimensions from current tty)
-        self._pty = PtyProcessUnicode.spawn (cmd,
+        self._pty = PtyProcessUnicode.spawn (self._cmd,
                         dimensions=get_term_dimensions())
         # for handling reading/writing to/from pty and writing
         # to the user's terminal
-        self._io = TermIOHandler (self._pty)
+        # (with a render process, both processes write to the screen,
+        # so the lock must be shared between them)
+        if split_process:
+            self._io = TermIOHandler (self._pty,
+                            stdout_lock=multiprocessing.RLock())
+        else:
+            self._io = TermIOHandler (self._pty)
         # set-up handling for terminal window resize
         self._setup_SIGWINCH_handler()
         self._has_been_resized = False
-        # set when the session ends
-        self._session_over_flag = threading.Event()
 
     def _setup_mode_controller (self):
         # which mode is the thinwrapper in?
@@ -91,11 +141,11 @@ class ThinWrapper():
         # returns a map of str -> value of var named by str
         self._hotkey_to_mode_map = dict (map (
             lambda tup: (tup[0], globals()[tup[1]]),
-            raw_hotkeys_map.iteritems()))
+            six.iteritems (raw_hotkeys_map)))
         # we need to reverse the direction of the above map
         # to build the mode -> key map
         self._mode_to_hotkey_map = dict (map (lambda tup: tup[::-1],
-                        self._hotkey_to_mode_map.iteritems()))
+                        six.iteritems (self._hotkey_to_mode_map)))
         # build a map of hotkeys active in each mode, and which modes they
         # will transition us to if received while in that mode
         # (for help in understanding how this map is used,
@@ -113,6 +163,18 @@ class ThinWrapper():
             QUIT_PROMPT: {}
         }
 
+    def _setup_triggers (self):
+        # read trigger definitions from pysshlm.cfg, a list of
+        # (regex, action) pairs
+        triggers = ast.literal_eval (pysshlm_config.get ("triggers"))
+        # with no triggers, skip scanning the output altogether
+        if len (triggers) == 0:
+            self._triggers = None
+            return
+        style = getattr (self._t,
+                        pysshlm_config.get ("trigger_highlight_style"))
+        self._triggers = TriggerEngine (triggers, (style, self._t.normal))
+
     #
     #
     # terminal handling functions
@@ -132,9 +194,9 @@ class ThinWrapper():
         # check if the window has changed size, and propagate
         # the sigwinch with self._pty.setwinsize() if so
         def check_resize():
-            while self._pty.isalive():
+            while not self._session_over_flag.is_set():
                 time.sleep (1)
-                if self._has_been_resized:
+                if self._has_been_resized and not self._offline_flag.is_set():
                     self._pty.setwinsize (*(get_term_dimensions()))
                     self._has_been_resized = False
         check_resize_thread = threading.Thread (target=check_resize)
@@ -176,7 +238,12 @@ class ThinWrapper():
         # ENTER submits the current line buffer
         if key == '\x0d':
             self._io.backspace (len (self._line_buffer))
-            self._io.pty_write (self._line_buffer + '\r')
+            with self._offline_queue_lock:
+                if self._offline_flag.is_set():
+                    self._offline_queue.append (self._line_buffer)
+                    self._io.display_notifier ("[offline: queued]")
+                else:
+                    self._io.pty_write (self._line_buffer + '\r')
             self._clear_line_buffer()
         # NOTE: delete / backspace both get mapped to KEY_DELETE by blessed
         # backspace a char
@@ -244,7 +311,86 @@ class ThinWrapper():
         self._io.display_notifier (self._line_buffered_mode_notifier_off)
 
     def _process_keypress_key_passthrough (self, key):
-        self._pty.write (key)
+        if self._offline_flag.is_set():
+            self._io.display_notifier ("[offline: use line-mode]", 0.8)
+        else:
+            self._pty.write (key)
+
+    #
+    #
+    # reconnection methods
+    #
+    #
+
+    # decide whether an EOF from the pty means the connection dropped,
+    # rather than the remote shell exiting
+    def _connection_dropped (self):
+        if not self._reconnect or self._session_over_flag.is_set():
+            return False
+        # wait for ssh to be reaped so its exit status is known,
+        # giving up (and ending the session) if it doesn't exit
+        deadline = time.time() + self.SSH_EXIT_TIMEOUT
+        while self._pty.isalive():
+            if time.time() > deadline:
+                return False
+            time.sleep (0.1)
+        return self._pty.exitstatus == self.SSH_CONNECTION_ERROR
+
+    # show the new session's output until the reconnected marker appears,
+    # returning False if ssh exits or the timeout passes first (eg. it's
+    # stuck connecting, or waiting at a password / host-key prompt)
+    def _wait_for_marker (self, timeout):
+        deadline = time.time() + timeout
+        tail = ""
+        while not self._session_over_flag.is_set():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            ready, _, _ = select.select ([self._pty.fd], [], [], remaining)
+            if not ready:
+                return False
+            try:
+                s = self._pty.read (size=1024)
+            except (EOFError, UnicodeDecodeError):
+                return False
+            self._io.screen_write (s)
+            tail = (tail + s) [-256:]
+            if self.RECONNECTED_MARKER in strip_escape_sequences (tail):
+                return True
+        return False
+
+    # respawn the pty with backoff until connected or the session ends,
+    # then replay any lines queued while offline
+    def _reconnect_session (self):
+        self._offline_flag.set()
+        # keep typing in line-mode while offline
+        self._mode_controller.transition_from (KEY_PASSTHROUGH, LINE_BUFFERED)
+        delay = float (pysshlm_config.get ("reconnect_initial_delay"))
+        max_delay = float (pysshlm_config.get ("reconnect_max_delay"))
+        connect_timeout = float (pysshlm_config.get (
+                        "reconnect_connect_timeout"))
+        while not self._session_over_flag.wait (delay):
+            self._io.screen_writeln ('[pysshlm] reconnecting...')
+            self._pty = PtyProcessUnicode.spawn (self._reconnect_cmd,
+                            dimensions=get_term_dimensions())
+            if self._wait_for_marker (connect_timeout):
+                break
+            self._pty.terminate (force=True)
+            delay = min (delay * 2, max_delay)
+        else:
+            return
+        self._io.set_pty (self._pty)
+        # each line leaves the queue only once written to the live session
+        with self._offline_queue_lock:
+            while len (self._offline_queue) != 0:
+                try:
+                    self._io.pty_write (self._offline_queue [0] + '\r')
+                except (OSError, IOError):
+                    # dropped again; the next read sees EOF and
+                    # reconnects, with the rest of the queue kept
+                    return
+                self._offline_queue.pop (0)
+            self._offline_flag.clear()
 
     #
     #
@@ -274,15 +420,19 @@ class ThinWrapper():
     def _on_press (self, key):
         # block keypress processing while a notifier active
         self._io.can_process_keypress_flag.wait()
-        # check if key pressed is a mode transition hotkey for the current mode
-        if self._key_is_hotkey (key):
-            # if it's active, act on it
-            new_mode = self._get_mode_for_hotkey (key)
-            self._mode_controller.transition_to (new_mode)
-        # else process the keypress according to the current mode
-        else:
-            key_processor = self._get_keypress_processor_method()
-            key_processor (key)
+        # hold the mode for the whole keypress, since the output thread
+        # may change it too (eg. on losing the connection)
+        with self._mode_controller.lock:
+            # check if key pressed is a mode transition hotkey for the
+            # current mode
+            if self._key_is_hotkey (key):
+                # if it's active, act on it
+                new_mode = self._get_mode_for_hotkey (key)
+                self._mode_controller.transition_to (new_mode)
+            # else process the keypress according to the current mode
+            else:
+                key_processor = self._get_keypress_processor_method()
+                key_processor (key)
 
     #
     #
@@ -290,21 +440,74 @@ class ThinWrapper():
     #
     #
 
-    def _flow_output (self):
-        # read from the pty output and forward to stdout
+    # read from the pty output and forward to stdout,
+    # raising EOFError when the pty closes
+    def _pump_output (self):
         while not self._session_over_flag.is_set():
             time.sleep (0.005)
+            s = self._pty.read (size=1024)
+            if self._triggers is not None:
+                s = self._triggers.process (s)
+            self._io.screen_write (s)
+
+    # run in the render process: pump output from the pty (inherited
+    # on fork) until it closes, and exit with the reason
+    def _run_render_process (self):
+        try:
+            self._pump_output()
+        except EOFError:
+            sys.exit (self.RENDER_EOF)
+        except UnicodeDecodeError as e:
+            self._report_decode_error (e)
+            sys.exit (self.RENDER_DECODE_ERROR)
+
+    # pump output in a render process and wait for it to stop,
+    # re-raising EOFError in this process
+    def _pump_output_in_process (self):
+        self._render_process = multiprocessing.Process (
+                        target=self._run_render_process)
+        # fork while holding the screen, so no thread of ours is halfway
+        # through a write which the child would inherit
+        self._io.lock_screen()
+        try:
+            self._render_process.start()
+        finally:
+            self._io.unlock_screen()
+        self._render_process.join()
+        exitcode = self._render_process.exitcode
+        if exitcode == self.RENDER_EOF:
+            raise EOFError
+        # the render process already reported a decode error, and is
+        # expected to be killed when the session ends
+        if (exitcode != self.RENDER_DECODE_ERROR and
+                not self._session_over_flag.is_set()):
+            self._io.screen_writeln (
+                            "[pysshlm]: render process failed (exit code %s)" %
+                            (exitcode,))
+        self.end_session()
+
+    def _report_decode_error (self, e):
+        self._io.screen_writeln ("[pysshlm]: %s." % (str (e),))
+        self._io.screen_writeln ("[pysshlm]: Possibly stdout of \
+                session tried to send binary data, such as when \
+                running \"cat\" on a binary file?")
+
+    def _flow_output (self):
+        while not self._session_over_flag.is_set():
             try:
-                s = self._pty.read (size=1024)
-                self._io.screen_write (s)
+                if self._split_process:
+                    self._pump_output_in_process()
+                else:
+                    self._pump_output()
             except EOFError:
+                if self._connection_dropped():
+                    self._io.screen_writeln ('[pysshlm] connection lost')
+                    self._reconnect_session()
+                    continue
                 self._io.screen_writeln ('[pysshlm] EOF')
                 self.end_session()
             except UnicodeDecodeError as e:
-                self._io.screen_writeln ("[pysshlm]: %s." % (str (e),))
-                self._io.screen_writeln ("[pysshlm]: Possibly stdout of \
-                        session tried to send binary data, such as when \
-                        running \"cat\" on a binary file?")
+                self._report_decode_error (e)
                 self.end_session()
 
     def _flow_input (self):
@@ -322,6 +525,9 @@ class ThinWrapper():
     def end_session (self):
         self._session_over_flag.set()
         self._pty.terminate()
+        if (self._render_process is not None and
+                self._render_process.is_alive()):
+            self._render_process.terminate()
 
     def exit (self):
         termios.tcsetattr (sys.stdin.fileno(),
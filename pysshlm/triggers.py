@@ -0,0 +1,113 @@
+import re
+
+
+# actions a trigger can take when its pattern is seen in the output
+BELL = 'bell'
+HIGHLIGHT = 'highlight'
+
+
+# scans the output stream for a set of patterns. The patterns of each
+# action are compiled into a single regex, so each chunk is searched
+# once per action no matter how many triggers exist. Where highlight
+# patterns overlap, the leftmost match wins (the earlier trigger, if they
+# start at the same place); bell patterns are matched separately, so a
+# highlight never hides a bell
+class TriggerEngine():
+
+    # how much of the previous chunk is kept to catch matches spanning
+    # a chunk boundary (patterns are matched within a line)
+    MAX_SPAN = 256
+
+    def __init__ (self, triggers, highlight_style):
+        # triggers is a list of (pattern, action) pairs
+        patterns = {BELL: [], HIGHLIGHT: []}
+        for pattern, action in triggers:
+            if action not in patterns:
+                raise ValueError ("trigger %r: unknown action %r" %
+                                (pattern, action))
+            # combining patterns renumbers their groups, which would
+            # break backreferences, so groups aren't allowed at all
+            compiled = re.compile (pattern)
+            if compiled.groups != 0:
+                raise ValueError ("trigger %r: capturing groups aren't "
+                                "supported, use (?:...) instead" %
+                                (pattern,))
+            # a pattern matching nothing would fire at every character
+            if compiled.match ('') is not None:
+                raise ValueError ("trigger %r: pattern matches the empty "
+                                "string" % (pattern,))
+            patterns [action].append (pattern)
+        self._matchers = {
+            BELL: self._combine (patterns [BELL]),
+            HIGHLIGHT: self._combine (patterns [HIGHLIGHT]),
+        }
+        # (start, end) terminal sequences wrapped around highlighted text
+        self._highlight_style = highlight_style
+        # the tail of the previous chunk, since the last line break
+        self._carry = ""
+        # where matching starts in self._carry: 1 when the carry was cut
+        # mid-line, and keeps the character before the cut so that ^
+        # doesn't match there
+        self._carry_pos = 0
+        # stream position of the start of self._carry, and of the end of
+        # the last match of each action, so a match is never acted on twice
+        self._carry_offset = 0
+        self._last_match_end = {BELL: 0, HIGHLIGHT: 0}
+
+    # scan a chunk of output, returning it with highlights applied and
+    # a bell appended if any bell trigger fired
+    def process (self, s):
+        text = self._carry + s
+        # where the new chunk starts within text
+        chunk_start = len (self._carry)
+        pieces = []
+        written = chunk_start
+        for m in self._new_matches (HIGHLIGHT, text, chunk_start):
+            # only the part of the match in this chunk can be
+            # highlighted, the rest has already been written
+            match_start = max (m.start(), chunk_start)
+            pieces.append (text [written:match_start])
+            pieces.append (self._highlight_style [0])
+            pieces.append (text [match_start:m.end()])
+            pieces.append (self._highlight_style [1])
+            written = m.end()
+        pieces.append (text [written:])
+        if any (self._new_matches (BELL, text, chunk_start)):
+            pieces.append ('\a')
+        self._keep_carry (text)
+        return ''.join (pieces)
+
+    def _combine (self, patterns):
+        if len (patterns) == 0:
+            return None
+        # ^ and $ match at line breaks, not wherever a chunk begins or ends
+        return re.compile ('|'.join ('(?:%s)' % (p,) for p in patterns),
+                        re.MULTILINE)
+
+    # yield the matches of an action's regex which end in the new chunk
+    # and haven't already been acted on
+    def _new_matches (self, action, text, chunk_start):
+        matcher = self._matchers [action]
+        if matcher is None:
+            return
+        for m in matcher.finditer (text, self._carry_pos):
+            start = self._carry_offset + m.start()
+            if (m.end() <= chunk_start or
+                    start < self._last_match_end [action]):
+                continue
+            self._last_match_end [action] = self._carry_offset + m.end()
+            yield m
+
+    # keep the tail of text for the next chunk
+    def _keep_carry (self, text):
+        line_start = text.rfind ('\n') + 1
+        cut = max (line_start, len (text) - self.MAX_SPAN)
+        # (if cut is 0, the carry starts where it did before)
+        if cut > 0:
+            if cut == line_start:
+                self._carry_pos = 0
+            else:
+                self._carry_pos = 1
+                cut -= 1
+        self._carry_offset += cut
+        self._carry = text [cut:]
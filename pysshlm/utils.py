@@ -1,5 +1,16 @@
 import os
+import re
+
+
+# terminal escape sequences: CSI (eg. colours, cursor moves), OSC (eg.
+# window titles) and character set selection (eg. tmux's \x1b(B)
+_ESCAPE_SEQUENCE_RE = re.compile (
+        r'\x1b\[[0-9;?]*[ -/]*[@-~]|\x1b\][^\x07]*\x07|\x1b[()][0-9A-Za-z]')
 
 
 def get_term_dimensions():
     return tuple (map (int, os.popen('stty size', 'r').read().split()))
+
+
+def strip_escape_sequences (s):
+    return _ESCAPE_SEQUENCE_RE.sub ('', s)
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+from pysshlm.host_runner import HostSession, HostTimeout, MultiHostRun
+
+
+# stands in for HostSession.run_command, without spawning ssh
+def fake_run_session (session):
+    if session.host == 'bad':
+        yield 'partial'
+        raise EOFError ('bad: session closed')
+    for i in range (3):
+        yield '%s-%d' % (session.host, i)
+
+
+def test_output_in_order_per_host():
+    run = MultiHostRun (['a', 'b', 'c'], fake_run_session, concurrency=2)
+    chunks = list (run)
+    for host in ['a', 'b', 'c']:
+        assert [s for h, s in chunks if h == host] == \
+            ['%s-%d' % (host, i) for i in range (3)]
+
+
+def test_hosts_run_in_order_with_one_worker():
+    run = MultiHostRun (['a', 'b'], fake_run_session, concurrency=1)
+    assert [h for h, s in run] == ['a', 'a', 'a', 'b', 'b', 'b']
+
+
+def test_errors_collected_per_host():
+    run = MultiHostRun (['a', 'bad', 'c'], fake_run_session, concurrency=3)
+    output = run.collect()
+    assert output == {'a': 'a-0a-1a-2', 'bad': 'partial', 'c': 'c-0c-1c-2'}
+    assert list (run.errors.keys()) == ['bad']
+    assert isinstance (run.errors ['bad'], EOFError)
+
+
+def test_close_stops_starting_hosts():
+    release = threading.Event()
+
+    def blocking_run_session (session):
+        yield session.host
+        release.wait()
+        yield 'never'
+
+    hosts = ['h%d' % (i,) for i in range (10)]
+    with MultiHostRun (hosts, blocking_run_session, concurrency=2) as run:
+        it = iter (run)
+        started = [next (it) [0], next (it) [0]]
+    release.set()
+    assert sorted (started) == ['h0', 'h1']
+    assert list (it) == []
+    assert run.errors == {}
+
+
+def test_close_releases_workers_blocked_on_full_queue():
+    def endless_run_session (session):
+        while True:
+            yield 'x'
+
+    run = MultiHostRun (['a', 'b'], endless_run_session, concurrency=2)
+    # let the workers fill the queue and block
+    while not run._queue.full():
+        time.sleep (0.01)
+    assert run._queue.qsize() == MultiHostRun.QUEUE_SIZE
+    run.close()
+    deadline = time.time() + 2
+    while len (run._sessions) != 0 and time.time() < deadline:
+        time.sleep (0.01)
+    assert len (run._sessions) == 0
+    assert list (run) == []
+
+# runs a local shell in place of ssh
+class LocalShellSession (HostSession):
+
+    def _command_cmd (self, command):
+        return ['sh', '-c', command]
+
+    def _script_cmd (self):
+        return ['sh']
+
+
+def test_run_command_local_shell():
+    session = LocalShellSession ('local')
+    output = ''.join (session.run_command ('echo one; sleep 0.2; echo two'))
+    assert output == 'one\r\ntwo\r\n'
+
+
+def test_run_script_waits_for_prompt():
+    # the output of the first line stops on ">" for a while, which must
+    # not be taken for the prompt
+    session = LocalShellSession ('local')
+    output = ''.join (session.run_script (
+                    ["printf 'x>'; sleep 1; echo tail", "echo second"],
+                    timeout=5))
+    assert output.index ('x>tail') < output.index ('echo second')
+    assert 'second\r\n' + session._prompt in output
+
+
+def test_run_script_timeout():
+    session = LocalShellSession ('local')
+    with pytest.raises (HostTimeout):
+        list (session.run_script (['sleep 5'], timeout=0.5))
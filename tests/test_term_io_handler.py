@@ -0,0 +1,39 @@
+import multiprocessing
+import threading
+import time
+
+from pysshlm.term_io_handler import TermIOHandler
+
+
+def test_screen_lock_shared_with_render_process (capfd):
+    io = TermIOHandler (None, stdout_lock=multiprocessing.RLock())
+    child = multiprocessing.Process (target=io.screen_write,
+                    args=('child',))
+    io.lock_screen()
+    try:
+        io.screen_write ('parent-1 ')
+        child.start()
+        # the child can't write while we hold the screen
+        time.sleep (0.3)
+        io.screen_write ('parent-2 ')
+    finally:
+        io.unlock_screen()
+    child.join()
+    assert child.exitcode == 0
+    assert capfd.readouterr().out == 'parent-1 parent-2 child'
+
+
+def test_screen_lock_nests():
+    io = TermIOHandler (None)
+    io.lock_screen()
+    io.screen_writeln ('nested')
+    io.unlock_screen()
+    # fully released, so another thread can take it
+    taken = []
+
+    def try_lock():
+        taken.append (io._stdout_lock.acquire (False))
+    other = threading.Thread (target=try_lock)
+    other.start()
+    other.join()
+    assert taken == [True]
@@ -0,0 +1,256 @@
+import os
+import select
+import threading
+import time
+
+import pytest
+from blessed.keyboard import Keystroke
+
+from pysshlm import thin_wrapper
+from pysshlm.config import pysshlm_config
+from pysshlm.modes import KEY_PASSTHROUGH, LINE_BUFFERED, QUIT_PROMPT
+from pysshlm.thin_wrapper import ThinWrapper
+
+
+# stands in for a PtyProcessUnicode, recording what's written to it
+class FakePty():
+
+    def __init__ (self, exitstatus=ThinWrapper.SSH_CONNECTION_ERROR,
+                  alive=False, failing_write=None):
+        self.written = []
+        self.exitstatus = exitstatus
+        self.alive = alive
+        # index of the write which raises, as if the connection dropped
+        self._failing_write = failing_write
+        self.terminated = False
+
+    def write (self, s):
+        if len (self.written) == self._failing_write:
+            raise OSError ('connection dropped')
+        self.written.append (s)
+
+    def read (self, size):
+        raise EOFError
+
+    def isalive (self):
+        return self.alive
+
+    def terminate (self, force=False):
+        self.terminated = True
+        self.alive = False
+
+    def setwinsize (self, rows, cols):
+        pass
+
+
+@pytest.fixture
+def no_tty (monkeypatch):
+    monkeypatch.setattr (thin_wrapper, 'get_term_dimensions',
+                    lambda: (24, 80))
+    monkeypatch.setitem (pysshlm_config, 'reconnect_initial_delay', '0.01')
+    monkeypatch.setitem (pysshlm_config, 'reconnect_max_delay', '0.02')
+
+
+# replaces PtyProcessUnicode.spawn, handing out the given ptys in turn
+@pytest.fixture
+def spawned (monkeypatch, no_tty):
+    ptys = []
+    spawned_cmds = []
+
+    class FakePtyProcess():
+        @staticmethod
+        def spawn (cmd, dimensions):
+            spawned_cmds.append (cmd)
+            return ptys.pop (0)
+
+    monkeypatch.setattr (thin_wrapper, 'PtyProcessUnicode', FakePtyProcess)
+    return ptys, spawned_cmds
+
+
+@pytest.fixture
+def wrapper (spawned):
+    ptys, _ = spawned
+    ptys.append (FakePty())
+    w = ThinWrapper (['ssh', '-t', 'host'], reconnect=True)
+    yield w
+    w.end_session()
+
+
+def test_lines_queued_while_offline (wrapper):
+    wrapper._mode_controller.transition_to (LINE_BUFFERED)
+    wrapper._offline_flag.set()
+    wrapper._add_to_line_buffer ('ls')
+    wrapper._process_keypress_line_buffered (Keystroke (u'\r'))
+    assert wrapper._offline_queue == ['ls']
+    assert wrapper._pty.written == []
+
+
+def test_passthrough_refused_while_offline (wrapper):
+    wrapper._offline_flag.set()
+    wrapper._process_keypress_key_passthrough (Keystroke (u'a'))
+    assert wrapper._pty.written == []
+
+
+def test_connection_dropped_by_exit_status (wrapper):
+    wrapper._pty.exitstatus = ThinWrapper.SSH_CONNECTION_ERROR
+    assert wrapper._connection_dropped()
+    wrapper._pty.exitstatus = 0
+    assert not wrapper._connection_dropped()
+
+
+def test_connection_dropped_only_with_reconnect (wrapper):
+    wrapper._reconnect = False
+    assert not wrapper._connection_dropped()
+
+
+def test_connection_dropped_gives_up_waiting_for_exit (wrapper):
+    wrapper._pty.alive = True
+    wrapper.SSH_EXIT_TIMEOUT = 0.2
+    start = time.time()
+    assert not wrapper._connection_dropped()
+    assert time.time() - start < 1
+
+
+def test_reconnect_replays_queue_in_order (wrapper, spawned):
+    ptys, spawned_cmds = spawned
+    new_pty = FakePty (alive=True)
+    ptys.append (new_pty)
+    wrapper._wait_for_marker = lambda timeout: True
+    wrapper._offline_queue = ['one', 'two']
+    wrapper._reconnect_session()
+    assert new_pty.written == ['one\r', 'two\r']
+    assert wrapper._offline_queue == []
+    assert not wrapper._offline_flag.is_set()
+    assert wrapper._mode_controller.mode == LINE_BUFFERED
+    assert spawned_cmds [-1] == wrapper._reconnect_cmd
+
+
+def test_reconnect_keeps_queue_when_replay_fails (wrapper, spawned):
+    ptys, _ = spawned
+    new_pty = FakePty (alive=True, failing_write=1)
+    ptys.append (new_pty)
+    wrapper._wait_for_marker = lambda timeout: True
+    wrapper._offline_queue = ['one', 'two', 'three']
+    wrapper._reconnect_session()
+    assert new_pty.written == ['one\r']
+    assert wrapper._offline_queue == ['two', 'three']
+    assert wrapper._offline_flag.is_set()
+
+
+def test_reconnect_retries_until_confirmed (wrapper, spawned):
+    ptys, _ = spawned
+    failed_pty = FakePty (alive=True)
+    new_pty = FakePty (alive=True)
+    ptys.extend ([failed_pty, new_pty])
+    confirmations = [False, True]
+    wrapper._wait_for_marker = lambda timeout: confirmations.pop (0)
+    wrapper._reconnect_session()
+    assert failed_pty.terminated
+    assert wrapper._pty is new_pty
+    assert wrapper._io._pty is new_pty
+
+
+def test_reconnect_leaves_quit_prompt_alone (wrapper, spawned):
+    ptys, _ = spawned
+    ptys.append (FakePty (alive=True))
+    wrapper._wait_for_marker = lambda timeout: True
+    wrapper._mode_controller.transition_to (LINE_BUFFERED)
+    wrapper._mode_controller.transition_to (QUIT_PROMPT)
+    wrapper._reconnect_session()
+    assert wrapper._mode_controller.mode == QUIT_PROMPT
+
+
+def test_transition_waits_for_mode_lock (wrapper):
+    controller = wrapper._mode_controller
+    transition = threading.Thread (target=controller.transition_from,
+                    args=(KEY_PASSTHROUGH, LINE_BUFFERED))
+    with controller.lock:
+        transition.start()
+        transition.join (0.2)
+        # held up while the keypress holding the lock is processed
+        assert transition.is_alive()
+        assert controller.mode == KEY_PASSTHROUGH
+    transition.join()
+    assert controller.mode == LINE_BUFFERED
+
+
+# read from a pty until its output contains s
+def read_until (pty, s, timeout=10):
+    output = ""
+    deadline = time.time() + timeout
+    while s not in output:
+        remaining = deadline - time.time()
+        assert remaining > 0, "%r not in %r" % (s, output)
+        ready, _, _ = select.select ([pty.fd], [], [], remaining)
+        if ready:
+            output += pty.read (size=1024)
+    return output
+
+
+def test_reconnect_reattaches_tmux (monkeypatch, no_tty):
+    socket = 'pysshlm-test-%d' % (os.getpid(),)
+    tmux = 'tmux -L %s -f /dev/null' % (socket,)
+    monkeypatch.setenv ('TERM', 'xterm')
+    monkeypatch.setitem (pysshlm_config, 'tmux_attach_command',
+                    '%s new-session -A -s pysshlm sh' % (tmux,))
+    # sh -c stands in for ssh, running the remote command locally
+    w = ThinWrapper (['sh', '-c'], reconnect=True, reattach='tmux')
+    try:
+        w._pty.write ('X=kept\r')
+        w._pty.write ('echo set-$X\r')
+        read_until (w._pty, 'set-kept')
+        # drop the connection, leaving the tmux session running
+        w._pty.terminate (force=True)
+        w._offline_queue = ['echo queued-$X']
+        w._reconnect_session()
+        assert not w._offline_flag.is_set()
+        read_until (w._pty, 'queued-kept')
+    finally:
+        w.end_session()
+        os.system ('%s kill-server 2>/dev/null' % (tmux,))
+
+
+def test_render_process_eof_raised (capfd, no_tty):
+    w = ThinWrapper (['sh', '-c', 'echo rendered'], split_process=True)
+    try:
+        with pytest.raises (EOFError):
+            w._pump_output_in_process()
+        assert w._render_process.exitcode == ThinWrapper.RENDER_EOF
+        assert 'rendered' in capfd.readouterr().out
+    finally:
+        w.end_session()
+
+
+def test_render_process_decode_error_ends_session (capfd, no_tty):
+    w = ThinWrapper (['sh', '-c', "printf '\\377'; sleep 1"],
+                    split_process=True)
+    w._pump_output_in_process()
+    assert w._render_process.exitcode == ThinWrapper.RENDER_DECODE_ERROR
+    assert w._session_over_flag.is_set()
+    assert 'binary data' in capfd.readouterr().out
+
+
+def test_render_process_crash_reported (capfd, no_tty):
+    w = ThinWrapper (['sh', '-c', 'sleep 1'], split_process=True)
+
+    def crash():
+        raise RuntimeError ('render crashed')
+    # (inherited by the render process on fork)
+    w._pump_output = crash
+    w._pump_output_in_process()
+    assert w._render_process.exitcode == 1
+    assert w._session_over_flag.is_set()
+    assert 'render process failed (exit code 1)' in capfd.readouterr().out
+
+
+def test_render_process_eof_reconnects (no_tty):
+    w = ThinWrapper (['sh', '-c', 'exit 255'], reconnect=True,
+                    split_process=True)
+    reconnects = []
+
+    def reconnect_session():
+        reconnects.append (w._render_process.exitcode)
+        w.end_session()
+    w._reconnect_session = reconnect_session
+    w._flow_output()
+    assert reconnects == [ThinWrapper.RENDER_EOF]
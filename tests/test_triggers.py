@@ -0,0 +1,79 @@
+import pytest
+
+from pysshlm.triggers import TriggerEngine
+
+
+def engine (triggers):
+    return TriggerEngine (triggers, ('<', '>'))
+
+
+def test_bell_split_across_chunks_rings_once():
+    e = engine ([('FAILED', 'bell')])
+    assert e.process ('build FAI') == 'build FAI'
+    assert e.process ('LED\n') == 'LED\n\a'
+    assert e.process ('done\n') == 'done\n'
+
+
+def test_back_to_back_matches_each_fire():
+    e = engine ([('FAILED', 'bell'), ('error', 'highlight')])
+    assert e.process ('FAILED\n') == 'FAILED\n\a'
+    assert e.process ('FAILED\n') == 'FAILED\n\a'
+    assert e.process ('errorerror') == '<error><error>'
+
+
+def test_partial_highlight_across_chunks():
+    e = engine ([('error', 'highlight')])
+    assert e.process ('an err') == 'an err'
+    assert e.process ('or here') == '<or> here'
+
+
+def test_highlight_does_not_hide_bell():
+    e = engine ([('error.*', 'highlight'), ('FAILED', 'bell')])
+    assert e.process ('error: FAILED\n') == '<error: FAILED>\n\a'
+
+
+def test_carry_cut_at_newline():
+    e = engine ([('FAILED', 'bell')])
+    e.process ('FAI\nxx')
+    assert e._carry == 'xx'
+    # FAI was before the line break, so this doesn't complete a match
+    assert e.process ('LED') == 'LED'
+
+
+def test_carry_capped():
+    e = engine ([('FAILED', 'bell')])
+    e.process ('x' * 1000)
+    assert e._carry [e._carry_pos:] == 'x' * TriggerEngine.MAX_SPAN
+
+
+def test_caret_matches_mid_chunk_line_start():
+    e = engine ([('^ERROR', 'bell')])
+    assert e.process ('ok\nERROR x\n') == 'ok\nERROR x\n\a'
+    assert e.process ('not an ERROR\n') == 'not an ERROR\n'
+
+
+def test_caret_does_not_match_where_carry_was_cut():
+    e = engine ([('^x', 'highlight')])
+    assert e.process ('x' * 1000) == '<x>' + 'x' * 999
+    assert e.process ('x') == 'x'
+
+
+def test_dollar_matches_line_end_mid_chunk():
+    e = engine ([('FAILED$', 'bell')])
+    assert e.process ('FAILED\nok\n') == 'FAILED\nok\n\a'
+
+
+def test_capturing_groups_rejected():
+    with pytest.raises (ValueError):
+        engine ([(r'(a)\1', 'highlight')])
+    engine ([(r'(?:a)+', 'highlight')])
+
+
+def test_empty_matching_pattern_rejected():
+    with pytest.raises (ValueError):
+        engine ([('x*', 'highlight')])
+
+
+def test_unknown_action_rejected():
+    with pytest.raises (ValueError):
+        engine ([('a', 'explode')])